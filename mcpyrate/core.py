@@ -110,12 +110,14 @@ class BaseMacroExpander(NodeTransformer):
 
         This is the standard visitor method; it continues an ongoing visit.
         """
-        if not self.bindings or isinstance(tree, Done):
+        # Equivalent to `not self.bindings`, but this runs for every node, and
+        # `ChainMap.__bool__` is slow. Writes to `self.bindings` go to `self.local_bindings`.
+        if not (self.local_bindings or global_bindings) or isinstance(tree, Done):
             return tree
         if tree is None:
             return None
-        if isinstance(tree, list):
-            new_tree = flatten(self.visit(elt) for elt in tree)
+        if type(tree) is list:
+            new_tree = flatten([self.visit(elt) for elt in tree])
             if new_tree:
                 tree[:] = new_tree
                 return tree
@@ -131,8 +133,14 @@ class BaseMacroExpander(NodeTransformer):
 
         This starts a new visit. The dynamic extents of visits may be nested.
         """
-        with self._recursive_mode(True):
+        # Same as `with self._recursive_mode(True)`, but inlined, because
+        # macros that expand inside-out call the entry points a lot.
+        wasrecursive = self.recursive
+        self.recursive = True
+        try:
             return self.visit(tree)
+        finally:
+            self.recursive = wasrecursive
 
     def visit_once(self, tree):
         """Entry point. Expand macros in `tree`, in non-recursive mode.
@@ -145,8 +153,12 @@ class BaseMacroExpander(NodeTransformer):
 
         This starts a new visit. The dynamic extents of visits may be nested.
         """
-        with self._recursive_mode(False):
+        wasrecursive = self.recursive
+        self.recursive = False
+        try:
             return Done(self.visit(tree))
+        finally:
+            self.recursive = wasrecursive
 
     def _recursive_mode(self, isrecursive: bool):
         """Context manager. Change recursive mode, restoring the old mode when the context exits."""
@@ -9,7 +9,6 @@ import importlib.util
 import os
 import pickle
 import sys
-import tokenize
 
 from . import compiler
 from .coreutils import resolve_package, ismacroimport
@@ -23,6 +22,11 @@ def source_to_xcode(self, data, path, *, _optimize=-1):
 
     This function is monkey-patched into `importlib.machinery.SourceFileLoader`.
     """
+    # If `path_stats` just parsed this very source, reuse its AST (see `_parsed_source`).
+    global _parsed_source
+    parsed, _parsed_source = _parsed_source, None
+    if parsed and parsed[0] == path and parsed[1] == data:
+        data = parsed[2]
     # `self.name` is absolute dotted module name, see `importlib.machinery.FileLoader`.
     return compiler.compile(data, filename=path, self_module=self.name)
 
@@ -55,6 +59,12 @@ def source_to_xcode(self, data, path, *, _optimize=-1):
 # the same dependency appears again at another place in the graph, we can get
 # its timestamp from the timestamp cache.
 #
+# Across interpreter runs, the macro-import statement cache file of each source
+# file also records its resolved timestamp, along with the mtimes of all of its
+# macro-dependencies (recursively), and the results of the module lookups that
+# found them. That saved result is used only if none of those have changed since,
+# so it is always current, also for `reload`.
+#
 _stdlib_path_stats = SourceFileLoader.path_stats
 def path_xstats(self, path):
     """[mcpyrate] Import hook to compute mtime, accounting for macro-imports.
@@ -75,24 +85,29 @@ def path_xstats(self, path):
     # Ignore stdlib, it's big and doesn't use macros. Allows faster error
     # exits, because an uncaught exception causes Python to load a ton of
     # .py based stdlib modules. Also makes `macropython -i` start faster.
-    if path in _stdlib_sourcefile_paths or not path.endswith(".py"):
+    if not path.endswith(".py") or path.startswith(_stdlib_dir):
         return _stdlib_path_stats(self, path)
     return path_stats(path)
 
 
-def _detect_stdlib_sourcefile_paths():
-    """Return a set of full paths of `.py` files that are part of Python's standard library."""
-    # Adapted from StackOverflow answer by Adam Spiers, https://stackoverflow.com/a/8992937
-    # Note we don't want to get module names, but full paths to `.py` files.
-    stdlib_dir = os.path.dirname(os.__file__)
-    paths = set()
-    for root, dirs, files in os.walk(stdlib_dir):
-        for filename in files:
-            if filename[-3:] == ".py":
-                paths.add(os.path.join(root, filename))
-    return paths
-_stdlib_sourcefile_paths = _detect_stdlib_sourcefile_paths()
+# Full path of Python's standard library directory, with a trailing path separator.
+# Every `.py` file in the standard library lives under this directory.
+_stdlib_dir = os.path.join(os.path.dirname(os.__file__), "")
+
+
+# When a source file has changed, `path_stats` must parse it to find its macro-imports,
+# and then Python calls `source_to_xcode` to recompile it, which would parse it again.
+# To avoid the second parse, `path_stats` leaves the AST here for `source_to_xcode`,
+# as `(path, source_bytes, tree)`. It's single-use; `source_to_xcode` always clears it.
+#
+# We do this only for modules that have no dialect-imports, because dialect source
+# transforms would change the source text before parsing.
+_parsed_source = None
 
+# The macro-import statement cache file starts with this header, followed by the pickled data.
+# Bump the version number when the layout of the data changes. A file with a different header
+# (including one in the older headerless format) is treated as missing, without unpickling it.
+_macroimport_cache_magic = b"MCP2"
 
 def path_stats(path, _stats_cache=None):
     """[mcpyrate] Compute a `.py` source file's mtime, accounting for macro-imports.
@@ -107,10 +122,33 @@ def path_stats(path, _stats_cache=None):
     `_stats_cache` is used internally to speed up the computation, in case the
     dependency graph hits the same source file multiple times.
     """
-    if _stats_cache is None:
+    return _path_stats(path, _stats_cache)[0]
+
+def _path_stats(path, _stats_cache, _spec_cache=None):
+    """Implementation of `path_stats`.
+
+    Return `(result, st_mtime_ns, deps)`, where `result` is the public return
+    value of `path_stats`, `st_mtime_ns` is that of `path` itself, and `deps`
+    describes the macro-dependencies of `path`, considered recursively. It is
+    a dict with items `path: st_mtime_ns` for the dependencies themselves, and
+    `(name, search_path): origin` for the module lookups that found them (see
+    `_lookups`). `_stats_cache` caches these triples by `path`.
+
+    If `path` is part of a macro-import cycle, `deps` is `None`, because then
+    it does not account for the whole dependency graph.
+
+    `_spec_cache` caches the results of `find_spec` by absolute module name,
+    because many modules may macro-import from the same module.
+    """
+    global _parsed_source
+    toplevel = _stats_cache is None
+    if toplevel:
         _stats_cache = {}
+    if _spec_cache is None:
+        _spec_cache = {}
     if path in _stats_cache:
         return _stats_cache[path]
+    tree = None
 
     stat_result = os.stat(path)
 
@@ -137,15 +175,35 @@ def path_stats(path, _stats_cache=None):
     try:
         macroimport_cache_valid = False
         with open(macroimport_cache_path, "rb") as importcachefile:
-            data = pickle.load(importcachefile)
-        if data["st_mtime_ns"] == stat_result.st_mtime_ns:
-            macroimport_cache_valid = True
+            if importcachefile.read(len(_macroimport_cache_magic)) == _macroimport_cache_magic:
+                data = pickle.load(importcachefile)
+                if data["st_mtime_ns"] == stat_result.st_mtime_ns:
+                    macroimport_cache_valid = True
     except Exception:
         pass
 
     if macroimport_cache_valid:
         macro_and_dialect_imports = data["macroimports"] + data["dialectimports"]
         has_relative_macroimports = data["has_relative_macroimports"]
+
+        # The previous run also saved the resolved mtime, and the mtimes of the
+        # macro-dependencies it was computed from. If none of those files have
+        # changed, and the module lookups still find the same files, we can skip
+        # the `find_spec` calls and the recursion into the dependencies.
+        #
+        # Most source files have no macro-imports. For those, there is nothing
+        # to resolve, so we don't need to check anything here.
+        if macro_and_dialect_imports:
+            try:
+                resolved = data["resolved"]
+                if _deps_unchanged(resolved["deps"]):
+                    entry = ({"mtime": resolved["mtime"], "size": None},
+                             stat_result.st_mtime_ns,
+                             resolved["deps"])
+                    _stats_cache[path] = entry
+                    return entry
+            except Exception:
+                pass
     else:
         # This can be slow, the point of `.pyc` is to avoid the parse-and-compile cost.
         # We do save the macro-expansion cost, though, and that's likely much more expensive.
@@ -154,35 +212,35 @@ def path_stats(path, _stats_cache=None):
         # TODO: doesn't need. How to detect those? Regex-search the source text?
         # TODO: Or just document it, that the dialect definition module *must* macro-import those macros
         # TODO: even if it just injects them in the template?
-        with tokenize.open(path) as sourcefile:
-            tree = ast.parse(sourcefile.read(), filename=path)
+        #
+        # `ast.parse` detects the source encoding (PEP 263) from the raw bytes by itself.
+        with open(path, "rb") as sourcefile:
+            source = sourcefile.read()
+        tree = ast.parse(source, filename=path)
 
         macroimports = []
         dialectimports = []
         def scan(tree):
+            # Single pass; dispatch on the statement type first, so that most
+            # statements cost just one type check.
             for stmt in tree.body:
-                if ismacroimport(stmt):
-                    macroimports.append(stmt)
-                elif ismacroimport(stmt, magicname="dialects"):
-                    dialectimports.append(stmt)
-                elif iswithphase(stmt, filename=path):  # for multi-phase compilation: scan also inside top-level `with phase`
+                T = type(stmt)
+                if T is ast.ImportFrom:
+                    if ismacroimport(stmt):
+                        macroimports.append(stmt)
+                    elif ismacroimport(stmt, magicname="dialects"):
+                        dialectimports.append(stmt)
+                elif T is ast.With and iswithphase(stmt, filename=path):  # for multi-phase compilation: scan also inside top-level `with phase`
                     scan(stmt)
         scan(tree)
 
         macro_and_dialect_imports = macroimports + dialectimports
         has_relative_macroimports = any(macroimport.level for macroimport in macro_and_dialect_imports)
 
-        # macro-import statement cache goes with the .pyc
-        if not sys.dont_write_bytecode:
-            data = {"st_mtime_ns": stat_result.st_mtime_ns,
-                    "macroimports": macroimports,
-                    "dialectimports": dialectimports,
-                    "has_relative_macroimports": has_relative_macroimports}
-            try:
-                with open(macroimport_cache_path, "wb") as importcachefile:
-                    pickle.dump(data, importcachefile)
-            except Exception:
-                pass
+        data = {"st_mtime_ns": stat_result.st_mtime_ns,
+                "macroimports": macroimports,
+                "dialectimports": dialectimports,
+                "has_relative_macroimports": has_relative_macroimports}
 
     # The rest of the lookup process depends on the configuration of the currently
     # running Python, particularly its `sys.path`, so we do it dynamically.
@@ -195,7 +253,21 @@ def path_stats(path, _stats_cache=None):
         except (ValueError, ImportError) as err:
             raise ImportError(f"while resolving absolute package name of {path}, which uses relative macro-imports") from err
 
+    mtime = stat_result.st_mtime_ns * 1e-9
+
+    # Provisional entry, in case the dependencies macro-import from `path`. Such a
+    # cycle is an error when the modules are actually imported, but let's not crash
+    # with infinite recursion before we get that far.
+    _stats_cache[path] = ({"mtime": mtime, "size": None}, stat_result.st_mtime_ns, None)
+
+    # We process the dependencies serially, on purpose. This runs inside Python's import
+    # machinery, and `find_spec` may import parent packages as a side effect, so it must
+    # not run in worker threads - but each dependency needs `find_spec` for its own
+    # dependencies. The rest of the work is mostly `ast.parse`, which holds the GIL.
+    # The I/O per file is one `stat` and one small read, and for unchanged files,
+    # the saved result in the macro-import statement cache skips the recursion anyway.
     mtimes = []
+    deps = {}
     for macroimport in macro_and_dialect_imports:
         if macroimport.module is None:
             approx_sourcecode = unparse_with_fallbacks(macroimport, debug=True, color=True)
@@ -203,13 +275,23 @@ def path_stats(path, _stats_cache=None):
             raise SyntaxError(f"{loc}\nmissing module name in macro-import")
         module_absname = importlib.util.resolve_name('.' * macroimport.level + macroimport.module, package_absname)
 
-        spec = importlib.util.find_spec(module_absname)
+        try:
+            spec = _spec_cache[module_absname]
+        except KeyError:
+            spec = _spec_cache[module_absname] = importlib.util.find_spec(module_absname)
         if spec:  # self-macro-imports have no `spec`, and that's fine.
             origin = spec.origin
-            stats = path_stats(origin, _stats_cache)
+            stats, origin_mtime_ns, origin_deps = _path_stats(origin, _stats_cache, _spec_cache)
             mtimes.append(stats["mtime"])
+            if deps is not None:
+                lookups = _lookups(module_absname)
+                if origin_deps is None or lookups is None:  # cycle, or an unusual import setup
+                    deps = None
+                else:
+                    deps.update(origin_deps)
+                    deps[origin] = origin_mtime_ns
+                    deps.update(lookups)
 
-    mtime = stat_result.st_mtime_ns * 1e-9
     # size = stat_result.st_size
     mtimes.append(mtime)
 
@@ -220,5 +302,114 @@ def path_stats(path, _stats_cache=None):
     #     https://github.com/python/cpython/blob/master/Lib/importlib/_bootstrap_external.py
     # Since our minimum is Python 3.8, let's put `size` there.
     result = {"mtime": max(mtimes), "size": None}  # and sum(sizes)? OTOH, as of Python 3.8, only 'mtime' is mandatory.
-    _stats_cache[path] = result
-    return result
+    entry = (result, stat_result.st_mtime_ns, deps)
+    _stats_cache[path] = entry
+
+    # macro-import statement cache goes with the .pyc
+    #
+    # We write it also when there are no macro-imports, since then next time, we can skip
+    # the parse. But in that case, a valid cache file needs no updating, because the
+    # resolved mtime is just that of `path` itself. Likewise, if we recomputed the same
+    # resolved mtime from the same dependencies, the file is already up to date.
+    if not sys.dont_write_bytecode:
+        if macro_and_dialect_imports and deps is not None:
+            resolved = {"mtime": result["mtime"],
+                        "deps": deps}
+            if data.get("resolved") != resolved:
+                data["resolved"] = resolved
+                _write_macroimport_cache(macroimport_cache_path, data)
+        elif not macroimport_cache_valid:
+            _write_macroimport_cache(macroimport_cache_path, data)
+
+    # Only at the top level; the dependencies were scanned after `path`, and
+    # `path` is the one Python is about to compile, if it has changed.
+    if toplevel and tree is not None and not dialectimports:
+        _parsed_source = (path, source, tree)
+    return entry
+
+
+def _write_macroimport_cache(macroimport_cache_path, data):
+    """Write a macro-import statement cache file, atomically.
+
+    We write to a temporary file first, and then move it into place, so that a crash
+    or a concurrent import in another process never leaves a truncated cache file.
+    Failures are ignored; the cache is just an optimization.
+    """
+    tmp_path = f"{macroimport_cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as importcachefile:
+            importcachefile.write(_macroimport_cache_magic)
+            pickle.dump(data, importcachefile, protocol=5)
+        os.replace(tmp_path, macroimport_cache_path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _lookups(module_absname):
+    """Return the module lookups that find the module `module_absname`.
+
+    For each component of the dotted name, from the outermost, we record the
+    module lookup the import system does, as an item `(name, search_path): origin`.
+    Here `search_path` is `None` for the top-level module, which is searched for on
+    `sys.path`, and for submodules, the `__path__` (as a `tuple`) of the parent package.
+
+    If the lookups give the same results later, the same files are found, even if
+    e.g. `sys.path` or the directory contents have changed in other ways. A new file
+    that shadows the module (such as `pkg/mac/__init__.py` appearing next to `pkg/mac.py`,
+    or a `mac.py` appearing earlier on `sys.path`) changes the result.
+
+    `find_spec` imports the parent packages, so they are in `sys.modules` by now.
+    If not, return `None`.
+    """
+    out = {}
+    search_path = None
+    components = module_absname.split(".")
+    for k in range(1, len(components) + 1):
+        name = ".".join(components[:k])
+        if k > 1:
+            search_path = getattr(sys.modules.get(".".join(components[:k - 1])), "__path__", None)
+            if search_path is None:
+                return None
+            search_path = tuple(search_path)
+        spec = _find_spec_uncached(name, search_path)
+        if spec is None:
+            return None
+        out[(name, search_path)] = spec.origin
+    return out
+
+def _find_spec_uncached(name, search_path):
+    """Find the module spec for `name`, like `importlib.util.find_spec`, but without looking in `sys.modules`.
+
+    `search_path` is as in `_lookups`. Return `None` if not found.
+    """
+    if search_path is not None:
+        search_path = list(search_path)
+    for finder in sys.meta_path:
+        if not hasattr(finder, "find_spec"):  # pkg_resources.extern.VendorImporter has no find_spec
+            continue
+        spec = finder.find_spec(name, search_path)
+        if spec is not None:
+            return spec
+    return None
+
+def _deps_unchanged(deps):
+    """Check that `deps` (see `_path_stats`) is still current.
+
+    That is, the dependency files still have the same mtimes, and the module
+    lookups still find the same files.
+    """
+    for key, value in deps.items():
+        if type(key) is tuple:
+            name, search_path = key
+            spec = _find_spec_uncached(name, search_path)
+            if spec is None or spec.origin != value:
+                return False
+            continue
+        try:
+            if os.stat(key).st_mtime_ns != value:
+                return False
+        except OSError:
+            return False
+    return True
@@ -9,9 +9,18 @@ __all__ = ["ASTMarker", "get_markers", "delete_markers", "check_no_markers_remai
 
 import ast
 
-from . import core, utils, walkers
+from . import core, utils
 
 
+class _Fields(tuple):
+    """Type of `ASTMarker._fields`.
+
+    A `tuple` that also supports adding a `list`, so that marker classes written for older
+    versions of `mcpyrate`, which do `self._fields += ["myfield"]` in `__init__`, keep working.
+    """
+    def __add__(self, other):
+        return _Fields(tuple.__add__(self, tuple(other)))
+
 class ASTMarker(ast.AST):
     """Base class for AST markers.
 
@@ -33,25 +42,52 @@ class ASTMarker(ast.AST):
     operators (some of which expand to markers) may only appear inside a quoted
     section. So just before the quote operator exits, it checks that all
     quasiquote markers within that section have been compiled away.
+
+    If your marker has more fields than just `body`, declare them in the class::
+
+        class MyMarker(ASTMarker):
+            _fields = ASTMarker._fields + ("myfield",)
+            def __init__(self, body, myfield):
+                super().__init__(body)
+                self.myfield = myfield
     """
+    _fields = _Fields(("body",))  # support ast.iter_fields
+
     # TODO: Silly default `None`, because `copy` and `deepcopy` call `__init__` without arguments,
     # TODO: though the docs say they behave like `pickle` (and wouldn't thus need to call __init__ at all!).
     def __init__(self, body=None):
         """body: the actual AST that is annotated by this marker"""
         self.body = body
-        self._fields = ["body"]  # support ast.iter_fields
+
+
+def _iter_markers(tree, cls):
+    """Yield any `cls` instances found in `tree`, in depth-first pre-order.
+
+    `tree` may also be a `list` of AST nodes (e.g. a statement suite).
+
+    Like `ast.walk`, but depth-first, so that the markers come out in source order.
+    Uses an explicit stack, so this is fast also for large trees.
+    """
+    stack = [tree]
+    pop = stack.pop
+    extend = stack.extend
+    while stack:
+        node = pop()
+        if type(node) is list:
+            extend(reversed(node))
+            continue
+        if not isinstance(node, ast.AST):
+            continue
+        if isinstance(node, cls):
+            yield node
+        # Some markers have an instance-level `_fields`, so look it up on the instance.
+        children = [getattr(node, name, None) for name in node._fields]
+        extend(reversed(children))
 
 
 def get_markers(tree, cls=ASTMarker):
     """Return a `list` of any `cls` instances found in `tree`. For output validation."""
-    class ASTMarkerCollector(walkers.ASTVisitor):
-        def examine(self, tree):
-            if isinstance(tree, cls):
-                self.collect(tree)
-            self.generic_visit(tree)
-    w = ASTMarkerCollector()
-    w.visit(tree)
-    return w.collected
+    return list(_iter_markers(tree, cls))
 
 
 def delete_markers(tree, cls=ASTMarker):
@@ -60,12 +96,58 @@ def delete_markers(tree, cls=ASTMarker):
     The deletion takes place by replacing each marker node with
     the actual AST node stored in its `body` attribute.
     """
-    class ASTMarkerDeleter(walkers.ASTTransformer):
-        def transform(self, tree):
-            if isinstance(tree, cls):
-                return self.visit(tree.body)
-            return self.generic_visit(tree)
-    return ASTMarkerDeleter().visit(tree)
+    # Same semantics as an `ASTTransformer` that replaces each marker with its
+    # (recursively processed) `body`: if the `body` is a `list`, it is spliced
+    # into a surrounding `list` field, and if it is `None`, the marker is removed
+    # from a `list` field, or the field is deleted from its parent node.
+    def strip(value, out):  # append `value`, without any markers, to the list `out`
+        while isinstance(value, cls):
+            value = value.body
+        if type(value) is list:
+            for item in value:
+                strip(item, out)
+        elif value is not None:
+            out.append(value)
+
+    def process_list(lst):  # strip markers from a `list`, in-place; queue its AST nodes
+        new_lst = []
+        for item in lst:
+            if isinstance(item, ast.AST):
+                strip(item, new_lst)
+            else:
+                new_lst.append(item)
+        lst[:] = new_lst
+        stack.extend(item for item in lst if isinstance(item, ast.AST))
+
+    stack = []
+    while isinstance(tree, cls):
+        tree = tree.body
+    if type(tree) is list:
+        process_list(tree)
+    elif isinstance(tree, ast.AST):
+        stack.append(tree)
+
+    while stack:
+        node = stack.pop()
+        for name in node._fields:
+            try:
+                value = getattr(node, name)
+            except AttributeError:
+                continue
+            if type(value) is list:
+                process_list(value)
+            elif isinstance(value, ast.AST):
+                while isinstance(value, cls):
+                    value = value.body
+                if value is None:
+                    delattr(node, name)
+                    continue
+                setattr(node, name, value)
+                if type(value) is list:
+                    process_list(value)
+                else:
+                    stack.append(value)
+    return tree
 
 
 def check_no_markers_remaining(tree, *, filename, cls=None):
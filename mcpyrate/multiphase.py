@@ -22,120 +22,131 @@ __all__ = ["phase", "ismultiphase", "detect_highest_phase", "isdebug", "multipha
 
 import ast
 import sys
-from copy import copy, deepcopy
 
 from . import compiler
 from .colorizer import ColorScheme, setcolor
 from .coreutils import ismacroimport, isfutureimport, inject_after_futureimports
-from .expander import destructure_candidate, namemacro, parametricmacro
+from .expander import namemacro, parametricmacro
 from .unparser import unparse_with_fallbacks
 
 # --------------------------------------------------------------------------------
 # Private utilities.
 
+def deepcopy_ast(tree):
+    """Deep-copy an AST, or a `list` of ASTs.
+
+    Same result as `copy.deepcopy(tree)` for an AST from the parser, but much faster,
+    because this skips the generic pickle-protocol machinery and the memo. Only AST nodes
+    and lists are copied; all other values (identifiers, constants, ...) are shared.
+    """
+    if type(tree) is list:
+        return [deepcopy_ast(elt) for elt in tree]
+    if not isinstance(tree, ast.AST):
+        return tree
+    cls = type(tree)
+    new = cls.__new__(cls)
+    newdict = new.__dict__
+    for name, value in tree.__dict__.items():
+        if type(value) is list or isinstance(value, ast.AST):
+            value = deepcopy_ast(value)
+        newdict[name] = value
+    return new
+
 def iswithphase(stmt, *, filename):
     """Check if AST node `stmt` is a `with phase[n]`, where `n >= 1` is an integer.
 
     Return `n`, or `False`.
     """
+    # The importer calls this for the top-level `with` statements of every module
+    # it scans for macro-imports, so we match the structure directly, instead of
+    # going through the general macro-invocation destructuring machinery.
     if type(stmt) is not ast.With:
         return False
-    if len(stmt.items) != 1:
+    items = stmt.items
+    if len(items) != 1:
         return False
 
-    item = stmt.items[0]
+    item = items[0]
     if item.optional_vars is not None:  # no as-part allowed
         return False
 
     candidate = item.context_expr
     if type(candidate) is not ast.Subscript:
         return False
-
-    macroname, macroargs = destructure_candidate(candidate, filename=filename)
-    if macroname != "phase":
-        return False
-    if not macroargs or len(macroargs) != 1:  # exactly one macro-argument
+    macroname = candidate.value
+    if type(macroname) is not ast.Name or macroname.id != "phase":
         return False
 
-    arg = macroargs[0]
-    if type(arg) is ast.Constant:
-        n = arg.value
-    elif type(arg) is ast.Num:  # TODO: Python 3.8: remove ast.Num
-        n = arg.n
+    if sys.version_info >= (3, 9, 0):  # Python 3.9+: no ast.Index wrapper
+        arg = candidate.slice
     else:
-        return False
+        arg = candidate.slice.value
+    if type(arg) is ast.Tuple:  # exactly one macro-argument
+        if len(arg.elts) != 1:
+            return False
+        arg = arg.elts[0]
 
+    if type(arg) is not ast.Constant:
+        return False
+    n = arg.value
     if not isinstance(n, int) or n < 1:
         return False
 
     return n
 
-def extract_phase(tree, *, filename, phase=0):
-    """Split `tree` into given `phase` and remaining parts.
+def extract_phases(tree, *, filename):
+    """Split `tree` into its phases.
 
     Primarily meant to be called with `tree` the AST of a module that
     uses macros, but works with any `tree` that has a `body` attribute,
     where that `body` is a `list` of statement AST nodes.
 
-    If `phase == 0`, just return `tree` as-is.
+    Return a list `phases`, where `phases[k]` is the code for phase `k`.
+    For `k >= 1`, it is a new `ast.Module`. The `body` attribute of the
+    original `tree` is overwritten with the code for phase 0, and `phases[0]`
+    is `tree` itself.
 
-    If `phase >= 1`, return the statements belonging to this phase as a new
-    `ast.Module`, and overwrite the `body` attribute of the original `tree`
-    with the code for `phase - 1`, also performing code lifting from `phase`
-    to `phase - 1`.
+    All code from phase `k + 1` is lifted to phase `k`. So the code for phase
+    `k >= 1` consists of the bodies of all `with phase[n]` blocks with `n >= k`,
+    in their original order, and any `__future__` imports. The code for phase 0
+    is the whole module, with the `with phase` wrappers dropped.
 
     The lifted AST is deep-copied to minimize confusion, since it may get
     edited by macros during macro expansion. (This guarantees that
     macro-expanding it, in either phase, gives the same result,
     up to and including any side effects of the macros.)
     """
-    if not isinstance(phase, int):
-        raise TypeError(f"`phase` must be `int`, got {type(phase)} with value {repr(phase)}")
-    if phase < 0:
-        raise ValueError(f"`phase` must be a positive integer, got {repr(phase)}")
-    if phase == 0:
-        return tree
+    # Determine the phase of each top-level statement just once.
+    # Statements not inside a `with phase` belong to phase 0.
+    tagged = [(iswithphase(stmt, filename=filename) or 0, stmt) for stmt in tree.body]
+    n = max((m for m, stmt in tagged), default=0)
+
+    phases = [tree]
+    for k in range(1, n + 1):
+        thisphase = []
+        for m, stmt in tagged:
+            if m >= k:
+                # The phase-`m` code itself, or a copy of it lifted from phase `m`.
+                thisphase.extend(stmt.body if m == k else deepcopy_ast(stmt.body))
+            elif not m and isfutureimport(stmt):
+                # Issue #28: `__future__` imports.
+                #
+                # `__future__` imports should affect all phases, because they change
+                # the semantics of the module they appear in. Essentially, they are
+                # a kind of dialect defined by the Python core itself.
+                thisphase.append(stmt)
+        phases.append(ast.Module(body=thisphase,
+                                 type_ignores=list(getattr(tree, "type_ignores", []))))
 
     remaining = []
-    def lift(withphase):  # Lift a `with phase[n]` code block to phase `n - 1`.
-        original_phase = iswithphase(withphase, filename=filename)
-        assert original_phase
-        if original_phase == 1:
-            # Lifting to phase 0. Drop the `with phase` wrapper.
-            remaining.extend(deepcopy(withphase.body))
+    for m, stmt in tagged:
+        if m:  # Lifting to phase 0. Drop the `with phase` wrapper.
+            remaining.extend(deepcopy_ast(stmt.body))
         else:
-            # Lifting to phase >= 1. Decrease the `n` in `with phase[n]`
-            # by one, so the block gets processed again in the next phase.
-            if sys.version_info >= (3, 9, 0):  # Python 3.9+: no ast.Index wrapper
-                macroarg = withphase.items[0].context_expr.slice
-            else:
-                macroarg = withphase.items[0].context_expr.slice.value
-
-            if type(macroarg) is ast.Constant:
-                macroarg.value -= 1
-            elif type(macroarg) is ast.Num:  # TODO: Python 3.8: remove ast.Num
-                macroarg.n -= 1
-            remaining.append(deepcopy(withphase))
-
-    thisphase = []
-    for stmt in tree.body:
-        if iswithphase(stmt, filename=filename) == phase:
-            thisphase.extend(stmt.body)
-            lift(stmt)
-        else:
-            # Issue #28: `__future__` imports.
-            #
-            # `__future__` imports should affect all phases, because they change
-            # the semantics of the module they appear in. Essentially, they are
-            # a kind of dialect defined by the Python core itself.
-            if isfutureimport(stmt):
-                thisphase.append(stmt)
             remaining.append(stmt)
     tree.body[:] = remaining
 
-    newmodule = copy(tree)
-    newmodule.body = thisphase
-    return newmodule
+    return phases
 
 # --------------------------------------------------------------------------------
 # Public utilities.
@@ -346,7 +357,6 @@ def multiphase_expand(tree, *, filename, self_module, dexpander=None, _optimize=
 
     Return value is the final phase-0 `tree`, after macro expansion.
     """
-    n = detect_highest_phase(tree, filename=filename)
     debug = isdebug(tree)
     c, CS = setcolor, ColorScheme
 
@@ -374,11 +384,13 @@ def multiphase_expand(tree, *, filename, self_module, dexpander=None, _optimize=
     # (This matters when there are at least 3 phases, see `demo/let.py`.)
     module = compiler.create_module(dotted_name=self_module, filename=filename, update_parent=False)
 
-    for k in range(n, -1, -1):  # phase 0 is what a regular compile would do
+    # Split the module into its phases up front, before any macro expansion takes place.
+    phases = extract_phases(tree, filename=filename)
+    for k in range(len(phases) - 1, -1, -1):  # phase 0 is what a regular compile would do
         if debug:
             print(f"{c(CS.HEADING1)}**AST for {c(CS.ATTENTION)}PHASE {k}{c(CS.HEADING1)} of module {c(CS.HEADING2)}'{self_module}' ({c(CS.SOURCEFILENAME)}{filename}{c(CS.HEADING2)}){c()}", file=sys.stderr)
 
-        phase_k_tree = extract_phase(tree, filename=filename, phase=k)
+        phase_k_tree = phases[k]
         if phase_k_tree.body:
             # inject `__phase__ = k` for introspection (at run time of the phase being compiled now)
             tgt = ast.Name(id="__phase__", ctx=ast.Store(), lineno=1, col_offset=1)
@@ -38,7 +38,20 @@ def _mcpyrate_quotes_attr(attr, *, force_import=False):
     hygienically unquoted values, whose eventual use site might not import
     any `mcpyrate` modules.
     """
-    return _mcpyrate_attr(f"quotes.{attr}", force_import=force_import)
+    if force_import:
+        return _mcpyrate_attr(f"quotes.{attr}", force_import=True)
+    # This is called for every node `astify` generates, so build the common case
+    # directly, without parsing a dotted name.
+    #
+    # `astify` calls this once per call for `attr="ast"`, and shares that result
+    # between all the nodes it generates. That is safe, even though the expander
+    # fills in source location info and `ctx` in-place. The source location of all
+    # of them is that of the same macro use site (`fix_locations(mode="reference")`),
+    # and in the global postprocess pass, `fix_ctx(copy_seen_nodes=True)` copies
+    # any node it has already seen, which splits the shared nodes apart again.
+    return ast.Attribute(value=ast.Attribute(value=ast.Name(id="mcpyrate"),
+                                             attr="quotes"),
+                         attr=attr)
 
 
 class QuasiquoteMarker(ASTMarker):
@@ -79,18 +92,20 @@ class LiftSourcecode(QuasiquoteMarker):
 
     This allows e.g. computing names of lexical variables.
     """
+    _fields = QuasiquoteMarker._fields + ("filename",)
+
     def __init__(self, body, filename):
         super().__init__(body)
         self.filename = filename
-        self._fields += ["filename"]
 
 
 class ASTLiteral(QuasiquoteMarker):  # similar to `macropy`'s `Literal`, but supports block mode, too.
     """Interpolate the given AST. Emitted by `a`."""
+    _fields = QuasiquoteMarker._fields + ("syntax",)
+
     def __init__(self, body, syntax):
         super().__init__(body)
         self.syntax = syntax
-        self._fields += ["syntax"]
 
 
 class ASTList(QuasiquoteMarker):
@@ -114,10 +129,11 @@ class Capture(QuasiquoteMarker):  # like `macropy`'s `Captured`
     to support bytecode caching for source files that invoke a macro that uses
     `h[]` in its output.)
     """
+    _fields = QuasiquoteMarker._fields + ("name",)
+
     def __init__(self, body, name):
         super().__init__(body)
         self.name = name
-        self._fields += ["name"]
 
 # --------------------------------------------------------------------------------
 # Run-time parts of the operators.
@@ -304,6 +320,12 @@ def capture_value(value, name):
                     [])
 
 
+# Strong references on purpose. Each capture site must keep returning the same
+# object, even when nothing else refers to it between runs (think of a captured
+# mutable list that is updated on each call), so a `WeakValueDictionary` would
+# change semantics. The keys can't be held weakly either, since `bytes` objects
+# don't support weak references. Growth is bounded by the number of capture
+# sites that have run in this process.
 _lookup_cache = {}
 def lookup_value(key):
     """Look up a hygienically captured run-time value. Used by `h[]`.
@@ -333,10 +355,14 @@ def lookup_value(key):
     if frozen_value is None:
         raise ValueError(f"The given key does not (yet) point to a value: {repr(key)}")
 
-    cachekey = (name, id(frozen_value))  # id() so each capture instance behaves independently
-    if cachekey not in _lookup_cache:
-        _lookup_cache[cachekey] = pickle.loads(frozen_value)
-    return _lookup_cache[cachekey]
+    # `id()` so each capture instance behaves independently. The cache entry
+    # keeps a reference to `frozen_value`, so that its `id` cannot be recycled
+    # for another capture while the entry exists.
+    cachekey = (name, id(frozen_value))
+    entry = _lookup_cache.get(cachekey)
+    if entry is None:
+        entry = _lookup_cache[cachekey] = (frozen_value, pickle.loads(frozen_value))
+    return entry[1]
 
 
 def capture_macro(macro, name):
@@ -629,9 +655,193 @@ def _is_mcpyrate_quotes_reference(tree):
         return False
 
 
+def _dotted_name(tree):
+    """Return the dotted name `tree` refers to, as a `str`.
+
+    `tree` must be an `ast.Name`, or a chain of `ast.Attribute` nodes ending
+    in an `ast.Name`, such as the AST for `mcpyrate.quotes.ast.Name`.
+    For any other input, return `None`.
+    """
+    acc = []
+    while type(tree) is ast.Attribute:
+        acc.append(tree.attr)
+        tree = tree.value
+    if type(tree) is not ast.Name:
+        return None
+    acc.append(tree.id)
+    return ".".join(reversed(acc))
+
+
 # --------------------------------------------------------------------------------
 # The quasiquote compiler and uncompiler.
 
+# Compile the unquote commands.
+#
+# Minimally, `astify` must support `ASTLiteral`; the others could be
+# implemented inside the unquote operators, as `ASTLiteral(ast.Call(...), "expr")`.
+# But maybe this approach is cleaner.
+#
+# Each handler takes `(x, recurse, expander)`, where `recurse` is the function
+# to call to astify any sub-values of `x`.
+
+def _astify_unquote(x, recurse, expander):  # `u[]`
+    # We want to generate an AST that compiles to the *value* of `x.body`,
+    # evaluated at the use site of `q`. But when the `q` expands, it is
+    # too early. We must `astify` *at the use site* of `q`. So use an
+    # `ast.Call` to delay until run-time, and pass in `x.body` as-is.
+    return ast.Call(_mcpyrate_quotes_attr("astify"), [x.body], [])
+
+def _astify_lift_sourcecode(x, recurse, expander):  # `n[]`
+    # Delay the identifier lifting, so it runs at the use site of `q`,
+    # where the actual value of `x.body` becomes available.
+    return ast.Call(_mcpyrate_quotes_attr("lift_sourcecode"),
+                    [x.body,
+                     ast.Constant(value=x.filename)],
+                    [])
+
+def _astify_ast_literal(x, recurse, expander):  # `a`
+    # Pass through this subtree as-is, but apply a run-time typecheck,
+    # as well as some special run-time handling for `list`s of AST nodes.
+    return ast.Call(_mcpyrate_quotes_attr("ast_literal"),
+                    [x.body,
+                     ast.Constant(value=x.syntax)],
+                    [])
+
+def _astify_ast_list(x, recurse, expander):  # `s[]`
+    return ast.Call(_mcpyrate_quotes_attr("ast_list"), [x.body], [])
+
+def _astify_ast_tuple(x, recurse, expander):  # `t[]`
+    return ast.Call(_mcpyrate_quotes_attr("ast_tuple"), [x.body], [])
+
+def _astify_capture(x, recurse, expander):  # `h[]`
+    if expander and type(x.body) is ast.Name:
+        function = expander.isbound(x.body.id)
+        if function:
+            # Hygienically capture a macro. We do this immediately,
+            # during the expansion of `q`, because the value we want to
+            # store, i.e. the macro function, is available only at
+            # macro-expansion time.
+            #
+            # This allows macros in scope at the use site of `q` to be
+            # hygienically propagated out to the use site of the macro
+            # that used `q`. So you can write macros that `q[h[macroname][...]]`,
+            # and `macroname` doesn't have to be macro-imported wherever
+            # that code gets spliced in.
+            return capture_macro(function, x.body.id)
+    # Hygienically capture a garden variety run-time value.
+    # At the use site of q[], this captures the value, and rewrites itself
+    # into an AST that represents a lookup. At the use site of the macro
+    # that used q[], that code runs, and looks up the captured value.
+    return ast.Call(_mcpyrate_quotes_attr("capture_value"),
+                    [x.body,
+                     ast.Constant(value=x.name)],
+                    [])
+
+# Builtin types. Mainly support for `u[]`, but also used by the
+# general case for AST node fields that contain bare values.
+#
+# Primitive values become an `ast.Constant`. These are the most common leaves
+# in a quoted tree, so `astify` checks for them first, before the dispatch table.
+_astify_primitive_types = frozenset((int, float, complex, str, bytes, bool, type(None), type(...)))
+
+def _astify_list(x, recurse, expander):
+    return ast.List(elts=[recurse(elt) for elt in x])
+
+def _astify_tuple(x, recurse, expander):
+    return ast.Tuple(elts=[recurse(elt) for elt in x])
+
+def _astify_dict(x, recurse, expander):
+    return ast.Dict(keys=[recurse(k) for k in x.keys()],
+                    values=[recurse(v) for v in x.values()])
+
+def _astify_set(x, recurse, expander):
+    return ast.Set(elts=[recurse(elt) for elt in x])
+
+# We must support at least the `Done` AST marker, so that things like
+# coverage dummy nodes and expanded name macros can be astified.
+# (Note we support only exactly `Done`, not arbitrary descendants.)
+def _astify_done(x, recurse, expander):
+    fields = [ast.keyword(a, recurse(b)) for a, b in ast.iter_fields(x)]
+    # We have imported `Done`, so we can refer to it as `mcpyrate.quotes.Done`.
+    node = ast.Call(_mcpyrate_quotes_attr("Done"),
+                    [],
+                    fields)
+    return node
+
+# General case.
+#
+# `quotes_ast` is an AST that refers to `mcpyrate.quotes.ast`. `astify` makes one
+# per call, and shares it between all the nodes it generates, since it's needed
+# for each astified AST node.
+def _astify_ast(x, recurse, expander, quotes_ast):
+    # TODO: Add support for astifying general ASTMarkers?
+    # Otherwise the same as regular AST node, but need to refer to the
+    # module it is defined in, and we don't have everything in scope here.
+    if isinstance(x, ASTMarker):
+        raise TypeError(f"Cannot astify internal AST markers, got {unparse(x)}")
+
+    # The magic is in the Call. Take apart the input AST, and construct a
+    # new AST, that (when compiled and run) will re-generate the input AST.
+    #
+    # We refer to the stdlib `ast` module as `mcpyrate.quotes.ast` to avoid
+    # name conflicts at the use site of `q[]`.
+    #
+    # This is the hot path of `astify`, and it recurses once per level of nesting
+    # in the input, so we keep it to one Python frame per level (no comprehension),
+    # and look up the fields directly instead of via `ast.iter_fields`.
+    fields = []
+    for name in type(x)._fields:
+        try:
+            value = getattr(x, name)
+        except AttributeError:  # missing field, skip it (like `ast.iter_fields` does)
+            continue
+        fields.append(ast.keyword(name, recurse(value)))
+    node = ast.Call(ast.Attribute(value=quotes_ast,
+                                  attr=x.__class__.__name__),
+                    [],
+                    fields)
+    # Copy source location info for correct coverage reporting of a quoted block.
+    #
+    # The location info we fill in here is for the use site of `q`, which is
+    # typically inside a macro definition. Coverage for a quoted line of code
+    # means that the expansion of the quote contains input from that line.
+    # It says nothing about the run-time behavior of that code.
+    #
+    # Running the AST produced by the quote re-produces the input AST, which is
+    # indeed the whole point of quoting stuff. The AST is re-produced **without
+    # any source location info**. The fact that *this* location info is missing,
+    # on purpose, is the magic that allows the missing location fixer to fill
+    # the correct location info at the final use site, i.e. the use site of the
+    # macro that used `q`.
+    node = ast.copy_location(node, x)
+    return node
+
+# Dispatch on the exact type of the value being astified, for types other than
+# primitives. AST node types that are not listed here are handled by the general
+# case, `_astify_ast`.
+_astify_dispatch = {Unquote: _astify_unquote,
+                    LiftSourcecode: _astify_lift_sourcecode,
+                    ASTLiteral: _astify_ast_literal,
+                    ASTList: _astify_ast_list,
+                    ASTTuple: _astify_ast_tuple,
+                    Capture: _astify_capture,
+                    list: _astify_list,
+                    tuple: _astify_tuple,
+                    dict: _astify_dict,
+                    set: _astify_set,
+                    Done: _astify_done}
+
+def _copy_node(node):
+    """Shallow-copy an AST node.
+
+    Same result as `copy.copy(node)`, but much faster, because this skips the
+    generic pickle-protocol machinery. `astify` does this a lot.
+    """
+    cls = type(node)
+    new = cls.__new__(cls)
+    new.__dict__.update(node.__dict__)
+    return new
+
 def astify(x, expander=None):  # like `macropy`'s `ast_repr`
     """Quasiquote compiler. Lift a value into its AST representation, if possible.
 
@@ -651,131 +861,181 @@ def astify(x, expander=None):  # like `macropy`'s `ast_repr`
 
     Raises `TypeError` if the lifting fails.
     """
+    # The parser shares one `ast.Load()` instance across the whole tree (likewise
+    # for the other `ctx` and operator nodes). Lift each such field-less node only
+    # once per call. The memo is keyed by `id`, which is safe because the input
+    # keeps all of its parts alive until we return.
+    #
+    # Only field-less nodes are memoized, so no part of the user's data is ever
+    # shared between occurrences in the output; a macro may edit one occurrence
+    # in-place without affecting others. A memo hit returns a copy with its own
+    # (empty) lists; only the `func`, `mcpyrate.quotes.ast.Load`, is shared, like
+    # `quotes_ast` (see `_mcpyrate_quotes_attr`).
+    memo = {}
+    quotes_ast = _mcpyrate_quotes_attr("ast")
     def recurse(x):  # second layer just to auto-pass `expander` by closure.
-        T = type(x)
-
-        # Compile the unquote commands.
-        #
-        # Minimally, `astify` must support `ASTLiteral`; the others could be
-        # implemented inside the unquote operators, as `ASTLiteral(ast.Call(...), "expr")`.
-        # But maybe this approach is cleaner.
-        if T is Unquote:  # `u[]`
-            # We want to generate an AST that compiles to the *value* of `x.body`,
-            # evaluated at the use site of `q`. But when the `q` expands, it is
-            # too early. We must `astify` *at the use site* of `q`. So use an
-            # `ast.Call` to delay until run-time, and pass in `x.body` as-is.
-            return ast.Call(_mcpyrate_quotes_attr("astify"), [x.body], [])
-
-        elif T is LiftSourcecode:  # `n[]`
-            # Delay the identifier lifting, so it runs at the use site of `q`,
-            # where the actual value of `x.body` becomes available.
-            return ast.Call(_mcpyrate_quotes_attr("lift_sourcecode"),
-                            [x.body,
-                             ast.Constant(value=x.filename)],
-                            [])
-
-        elif T is ASTLiteral:  # `a`
-            # Pass through this subtree as-is, but apply a run-time typecheck,
-            # as well as some special run-time handling for `list`s of AST nodes.
-            return ast.Call(_mcpyrate_quotes_attr("ast_literal"),
-                            [x.body,
-                             ast.Constant(value=x.syntax)],
-                            [])
-
-        elif T is ASTList:  # `s[]`
-            return ast.Call(_mcpyrate_quotes_attr("ast_list"), [x.body], [])
-
-        elif T is ASTTuple:  # `t[]`
-            return ast.Call(_mcpyrate_quotes_attr("ast_tuple"), [x.body], [])
-
-        elif T is Capture:  # `h[]`
-            if expander and type(x.body) is ast.Name:
-                function = expander.isbound(x.body.id)
-                if function:
-                    # Hygienically capture a macro. We do this immediately,
-                    # during the expansion of `q`, because the value we want to
-                    # store, i.e. the macro function, is available only at
-                    # macro-expansion time.
-                    #
-                    # This allows macros in scope at the use site of `q` to be
-                    # hygienically propagated out to the use site of the macro
-                    # that used `q`. So you can write macros that `q[h[macroname][...]]`,
-                    # and `macroname` doesn't have to be macro-imported wherever
-                    # that code gets spliced in.
-                    return capture_macro(function, x.body.id)
-            # Hygienically capture a garden variety run-time value.
-            # At the use site of q[], this captures the value, and rewrites itself
-            # into an AST that represents a lookup. At the use site of the macro
-            # that used q[], that code runs, and looks up the captured value.
-            return ast.Call(_mcpyrate_quotes_attr("capture_value"),
-                            [x.body,
-                             ast.Constant(value=x.name)],
-                            [])
-
-        # Builtin types. Mainly support for `u[]`, but also used by the
-        # general case for AST node fields that contain bare values.
-        elif T in (int, float, str, bytes, bool, type(None), type(...)):
+        if type(x) in _astify_primitive_types:
             return ast.Constant(value=x)
-
-        elif T is list:
-            return ast.List(elts=list(recurse(elt) for elt in x))
-        elif T is tuple:
-            return ast.Tuple(elts=list(recurse(elt) for elt in x))
-        elif T is dict:
-            return ast.Dict(keys=list(recurse(k) for k in x.keys()),
-                            values=list(recurse(v) for v in x.values()))
-        elif T is set:
-            return ast.Set(elts=list(recurse(elt) for elt in x))
-
-        # We must support at least the `Done` AST marker, so that things like
-        # coverage dummy nodes and expanded name macros can be astified.
-        # (Note we support only exactly `Done`, not arbitrary descendants.)
-        elif T is Done:
-            fields = [ast.keyword(a, recurse(b)) for a, b in ast.iter_fields(x)]
-            # We have imported `Done`, so we can refer to it as `mcpyrate.quotes.Done`.
-            node = ast.Call(_mcpyrate_quotes_attr("Done"),
-                            [],
-                            fields)
-            return node
-
-        # General case.
-        elif isinstance(x, ast.AST):
-            # TODO: Add support for astifying general ASTMarkers?
-            # Otherwise the same as regular AST node, but need to refer to the
-            # module it is defined in, and we don't have everything in scope here.
-            if isinstance(x, ASTMarker):
-                raise TypeError(f"Cannot astify internal AST markers, got {unparse(x)}")
-
-            # The magic is in the Call. Take apart the input AST, and construct a
-            # new AST, that (when compiled and run) will re-generate the input AST.
-            #
-            # We refer to the stdlib `ast` module as `mcpyrate.quotes.ast` to avoid
-            # name conflicts at the use site of `q[]`.
-            fields = [ast.keyword(a, recurse(b)) for a, b in ast.iter_fields(x)]
-            node = ast.Call(ast.Attribute(value=_mcpyrate_quotes_attr("ast"),
-                                          attr=x.__class__.__name__),
-                            [],
-                            fields)
-            # Copy source location info for correct coverage reporting of a quoted block.
-            #
-            # The location info we fill in here is for the use site of `q`, which is
-            # typically inside a macro definition. Coverage for a quoted line of code
-            # means that the expansion of the quote contains input from that line.
-            # It says nothing about the run-time behavior of that code.
-            #
-            # Running the AST produced by the quote re-produces the input AST, which is
-            # indeed the whole point of quoting stuff. The AST is re-produced **without
-            # any source location info**. The fact that *this* location info is missing,
-            # on purpose, is the magic that allows the missing location fixer to fill
-            # the correct location info at the final use site, i.e. the use site of the
-            # macro that used `q`.
-            node = ast.copy_location(node, x)
-            return node
-
-        raise TypeError(f"Don't know how to astify {repr(x)}")
+        handler = _astify_dispatch.get(type(x))
+        if handler is not None:
+            return handler(x, recurse, expander)
+        if not isinstance(x, ast.AST):
+            raise TypeError(f"Don't know how to astify {repr(x)}")
+        if type(x)._fields:
+            return _astify_ast(x, recurse, expander, quotes_ast)
+        key = id(x)
+        result = memo.get(key)
+        if result is None:
+            result = memo[key] = _astify_ast(x, recurse, expander, quotes_ast)
+        new = _copy_node(result)
+        new.args = []
+        new.keywords = []
+        return new
     return recurse(x)
 
 
+# Uncompile astified values. Each handler takes the `tree` to uncompile.
+#
+# CAUTION: in `unastify`, we implement only what we minimally need.
+
+def _lookup_thing(dotted_name):
+    if not dotted_name.startswith("mcpyrate.quotes"):
+        raise NotImplementedError(f"Don't know how to look up {repr(dotted_name)}")
+    path = dotted_name.split(".")
+    if not all(component.isidentifier() for component in path):
+        raise NotImplementedError(f"Dotted name {repr(dotted_name)} contains at least one non-identifier component")
+    if len(path) < 3:
+        raise NotImplementedError(f"Dotted name {repr(dotted_name)} has fewer than two dots (expected 'mcpyrate.quotes.something')")
+    name_of_thing = path[2]
+    thing = globals()[name_of_thing]
+    if len(path) > 3:
+        for attrname in path[3:]:
+            thing = getattr(thing, attrname)
+    return thing
+
+def _unastify_constant(tree):
+    return tree.value
+
+# Support machinery for `Call` AST node. This serendipitously supports also
+# *args and **kwargs, because at least in Pythons 3.6, 3.7, 3.8, 3.9, 3.10
+# those appear in `args` and `keywords`, and `Starred` needs no special support here.
+def _unastify_list(tree):
+    return [unastify(elt) for elt in tree]
+
+def _unastify_keyword(tree):
+    return tree.arg, unastify(tree.value)
+
+def _unastify_List(tree):
+    return [unastify(elt) for elt in tree.elts]
+
+def _unastify_Tuple(tree):
+    return tuple(unastify(elt) for elt in tree.elts)
+
+def _unastify_Dict(tree):
+    return {unastify(k): unastify(v) for k, v in zip(tree.keys, tree.values)}
+
+def _unastify_Set(tree):
+    return {unastify(elt) for elt in tree.elts}
+
+def _unastify_Call(tree):
+    dotted_name = _dotted_name(tree.func) or unparse(tree.func)
+
+    # General case, fast path: an astified node of a stdlib AST node type.
+    # This is by far the most common case, so check it first, and look up the
+    # node type directly instead of going through `_lookup_thing`.
+    prefix, _, classname = dotted_name.rpartition(".")
+    if prefix == "mcpyrate.quotes.ast":
+        return _unastify_ast_node(getattr(ast, classname), tree)
+
+    # Drop the run-time part of `q`, if present. This is added by `q` itself,
+    # not `astify`, but `unastify` is usually applied to the output of `q`.
+    if dotted_name == "mcpyrate.quotes.splice_ast_literals":  # `q[]`
+        body = tree.args[0]
+        return unastify(body)
+
+    # Even though the unquote operators compile into calls, `unastify`
+    # must not apply their run-time parts, because it's running in the
+    # wrong context. Those only work properly at run time, and they
+    # must run at the use site of `q`, where the user-provided names
+    # (where the unquoted data comes from) will be in scope.
+    #
+    # So we undo what `astify` did, converting the unquote calls back into
+    # the corresponding AST markers.
+    elif dotted_name == "mcpyrate.quotes.astify":  # `u[]`
+        body = tree.args[0]
+        return Unquote(body)
+    elif dotted_name == "mcpyrate.quotes.lift_sourcecode":  # `n[]`
+        body, filename = tree.args[0], tree.args[1].value
+        return LiftSourcecode(body, filename)
+    elif dotted_name == "mcpyrate.quotes.ast_literal":  # `a[]`
+        body, syntax = tree.args[0], tree.args[1].value
+        return ASTLiteral(body, syntax)
+    elif dotted_name == "mcpyrate.quotes.ast_list":  # `s[]`
+        body = tree.args[0]
+        return ASTList(body)
+    elif dotted_name == "mcpyrate.quotes.ast_tuple":  # `t[]`
+        body = tree.args[0]
+        return ASTTuple(body)
+    elif dotted_name == "mcpyrate.quotes.capture_value":  # `h[]` (run-time value)
+        body, name = tree.args[0], tree.args[1].value
+        return Capture(body, name)
+    elif dotted_name == "mcpyrate.quotes.lookup_macro":  # `h[]` (macro)
+        # `capture_macro` is done and gone by the time we get here.
+        # `astify` has generated an `ast.Call` to `lookup_macro`.
+        #
+        # To make the this work properly even across process boundaries,
+        # we cannot simply run the `lookup_macro`. It injects the binding
+        # once, and then becomes an inert lexical name (pointing to that
+        # binding) - so that strategy only works inside the same process.
+        #
+        # We can't just leave the `lookup_macro` call in the AST, either,
+        # since that doesn't make any sense when the tree is later sent
+        # to `astify` to compile it again (we don't want another `ast.Call`
+        # layer around it).
+        #
+        # So we need something that triggers `capture_macro` when the
+        # result is astified again.
+        #
+        # Hence, we uncompile the `lookup_macro` into a `Capture` marker.
+        #
+        # But if the astified tree comes from an earlier run (in another
+        # Python process), the original macro name might not be in the
+        # expander's bindings any more.
+        #
+        # So we inject the captured macro into the expander's global
+        # bindings table now (by calling `lookup_macro`), and make the
+        # uncompiled capture command capture that macro.
+        #
+        # This does make the rather mild assumption that our input tree
+        # will be astified again in the same Python process, in order for
+        # the uncompiled capture to succeed when `astify` compiles it.
+        key = tree.args[0]
+        assert type(key) is ast.Tuple
+        assert all(type(elt) is ast.Constant for elt in key.elts)
+        name, unique_name, frozen_macro = [elt.value for elt in key.elts]
+        uniquename_node = lookup_macro((name, unique_name, frozen_macro))
+        return Capture(uniquename_node, name)
+
+    # General case: an astified AST node.
+    return _unastify_ast_node(_lookup_thing(dotted_name), tree)
+
+def _unastify_ast_node(callee, tree):
+    args = unastify(tree.args)
+    kwargs = {k: v for k, v in unastify(tree.keywords)}
+    node = callee(*args, **kwargs)
+    node = ast.copy_location(node, tree)
+    return node
+
+_unastify_dispatch = {ast.Constant: _unastify_constant,
+                      list: _unastify_list,
+                      ast.keyword: _unastify_keyword,
+                      ast.List: _unastify_List,
+                      ast.Tuple: _unastify_Tuple,
+                      ast.Dict: _unastify_Dict,
+                      ast.Set: _unastify_Set,
+                      ast.Call: _unastify_Call}
+
+
 def unastify(tree):
     """Quasiquote uncompiler. Approximate inverse of `astify`.
 
@@ -805,126 +1065,9 @@ def unastify(tree):
     family of macros. Prefer the `r` variants; they expand at run time, so
     you'll get the final AST with the actual unquoted values spliced in.
     """
-    # CAUTION: in `unastify`, we implement only what we minimally need.
-    our_module_globals = globals()
-    def lookup_thing(dotted_name):
-        if not dotted_name.startswith("mcpyrate.quotes"):
-            raise NotImplementedError(f"Don't know how to look up {repr(dotted_name)}")
-        path = dotted_name.split(".")
-        if not all(component.isidentifier() for component in path):
-            raise NotImplementedError(f"Dotted name {repr(dotted_name)} contains at least one non-identifier component")
-        if len(path) < 3:
-            raise NotImplementedError(f"Dotted name {repr(dotted_name)} has fewer than two dots (expected 'mcpyrate.quotes.something')")
-        name_of_thing = path[2]
-        thing = our_module_globals[name_of_thing]
-        if len(path) > 3:
-            for attrname in path[3:]:
-                thing = getattr(thing, attrname)
-        return thing
-
-    T = type(tree)
-
-    if T is ast.Constant:
-        return tree.value
-
-    # Support machinery for `Call` AST node. This serendipitously supports also
-    # *args and **kwargs, because at least in Pythons 3.6, 3.7, 3.8, 3.9, 3.10
-    # those appear in `args` and `keywords`, and `Starred` needs no special support here.
-    elif T is list:
-        return [unastify(elt) for elt in tree]
-    elif T is ast.keyword:
-        return tree.arg, unastify(tree.value)
-
-    elif T is ast.List:
-        return [unastify(elt) for elt in tree.elts]
-    elif T is ast.Tuple:
-        return tuple(unastify(elt) for elt in tree.elts)
-    elif T is ast.Dict:
-        return {unastify(k): unastify(v) for k, v in zip(tree.keys, tree.values)}
-    elif T is ast.Set:
-        return {unastify(elt) for elt in tree.elts}
-
-    elif T is ast.Call:
-        dotted_name = unparse(tree.func)
-
-        # Drop the run-time part of `q`, if present. This is added by `q` itself,
-        # not `astify`, but `unastify` is usually applied to the output of `q`.
-        if dotted_name == "mcpyrate.quotes.splice_ast_literals":  # `q[]`
-            body = tree.args[0]
-            return unastify(body)
-
-        # Even though the unquote operators compile into calls, `unastify`
-        # must not apply their run-time parts, because it's running in the
-        # wrong context. Those only work properly at run time, and they
-        # must run at the use site of `q`, where the user-provided names
-        # (where the unquoted data comes from) will be in scope.
-        #
-        # So we undo what `astify` did, converting the unquote calls back into
-        # the corresponding AST markers.
-        elif dotted_name == "mcpyrate.quotes.astify":  # `u[]`
-            body = tree.args[0]
-            return Unquote(body)
-        elif dotted_name == "mcpyrate.quotes.lift_sourcecode":  # `n[]`
-            body, filename = tree.args[0], tree.args[1].value
-            return LiftSourcecode(body, filename)
-        elif dotted_name == "mcpyrate.quotes.ast_literal":  # `a[]`
-            body, syntax = tree.args[0], tree.args[1].value
-            return ASTLiteral(body, syntax)
-        elif dotted_name == "mcpyrate.quotes.ast_list":  # `s[]`
-            body = tree.args[0]
-            return ASTList(body)
-        elif dotted_name == "mcpyrate.quotes.ast_tuple":  # `t[]`
-            body = tree.args[0]
-            return ASTTuple(body)
-        elif dotted_name == "mcpyrate.quotes.capture_value":  # `h[]` (run-time value)
-            body, name = tree.args[0], tree.args[1].value
-            return Capture(body, name)
-        elif dotted_name == "mcpyrate.quotes.lookup_macro":  # `h[]` (macro)
-            # `capture_macro` is done and gone by the time we get here.
-            # `astify` has generated an `ast.Call` to `lookup_macro`.
-            #
-            # To make the this work properly even across process boundaries,
-            # we cannot simply run the `lookup_macro`. It injects the binding
-            # once, and then becomes an inert lexical name (pointing to that
-            # binding) - so that strategy only works inside the same process.
-            #
-            # We can't just leave the `lookup_macro` call in the AST, either,
-            # since that doesn't make any sense when the tree is later sent
-            # to `astify` to compile it again (we don't want another `ast.Call`
-            # layer around it).
-            #
-            # So we need something that triggers `capture_macro` when the
-            # result is astified again.
-            #
-            # Hence, we uncompile the `lookup_macro` into a `Capture` marker.
-            #
-            # But if the astified tree comes from an earlier run (in another
-            # Python process), the original macro name might not be in the
-            # expander's bindings any more.
-            #
-            # So we inject the captured macro into the expander's global
-            # bindings table now (by calling `lookup_macro`), and make the
-            # uncompiled capture command capture that macro.
-            #
-            # This does make the rather mild assumption that our input tree
-            # will be astified again in the same Python process, in order for
-            # the uncompiled capture to succeed when `astify` compiles it.
-            key = tree.args[0]
-            assert type(key) is ast.Tuple
-            assert all(type(elt) is ast.Constant for elt in key.elts)
-            name, unique_name, frozen_macro = [elt.value for elt in key.elts]
-            uniquename_node = lookup_macro((name, unique_name, frozen_macro))
-            return Capture(uniquename_node, name)
-
-        else:
-            # General case: an astified AST node.
-            callee = lookup_thing(dotted_name)
-            args = unastify(tree.args)
-            kwargs = {k: v for k, v in unastify(tree.keywords)}
-            node = callee(*args, **kwargs)
-            node = ast.copy_location(node, tree)
-            return node
-
+    handler = _unastify_dispatch.get(type(tree))
+    if handler is not None:
+        return handler(tree)
     raise TypeError(f"Don't know how to unastify {unparse_with_fallbacks(tree, debug=True, color=True)}")
 
 # --------------------------------------------------------------------------------
@@ -3,14 +3,29 @@
 
 __all__ = ["doc", "sourcecode", "get_makemacro_sourcecode"]
 
-from functools import partial
+from functools import lru_cache, partial
 import inspect
+import os
 import sys
 import textwrap
 
 from ..colorizer import colorize, ColorScheme
 
 
+class _ByIdentity:
+    """Wrapper that hashes and compares its `obj` by identity.
+
+    For use as a cache key, because the objects we look at are not necessarily hashable.
+    """
+    __slots__ = ("obj",)
+    def __init__(self, obj):
+        self.obj = obj
+    def __hash__(self):
+        return id(self.obj)
+    def __eq__(self, other):
+        return self.obj is other.obj
+
+
 def _get_source(obj):
     # `inspect.getsourcefile` accepts "a module, class, method, function,
     # traceback, frame, or code object" (the error message says this if
@@ -20,12 +35,34 @@ def _get_source(obj):
     for x in (obj, obj.__class__):  # TODO: other places to fall back to?
         try:
             filename = inspect.getsourcefile(x)
-            source, firstlineno = inspect.getsourcelines(x)
-            return filename, source, firstlineno
+            return _get_source_of(_ByIdentity(x), filename, _file_version(filename))
         except (TypeError, OSError):
             continue
     raise NotImplementedError
 
+def _file_version(filename):
+    """Return something that changes when the file `filename` is edited, or `None`."""
+    try:
+        stat_result = os.stat(filename)
+    except (TypeError, OSError):  # no file, e.g. code typed into the REPL
+        return None
+    return (stat_result.st_mtime_ns, stat_result.st_size)
+
+# Users of a REPL tend to look at the same objects repeatedly, and finding the
+# source of e.g. a class requires parsing the whole file it is in. So cache the
+# results. Failures raise, so they are not cached (and instances, for which
+# `inspect` always fails, don't pile up in the cache).
+#
+# Users of a REPL also edit their code and `importlib.reload` it, which keeps the
+# same module object. So the version of the source file is part of the key.
+#
+# The cache keeps the object alive, so its `id` can't be recycled while the
+# cache entry exists.
+@lru_cache(maxsize=256)
+def _get_source_of(key, filename, version):
+    source, firstlineno = inspect.getsourcelines(key.obj)
+    return filename, source, firstlineno
+
 
 def doc(obj, *, file=None, end="\n"):
     """Print an object's docstring non-interactively.
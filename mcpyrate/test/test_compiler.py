@@ -16,11 +16,13 @@ Contains some advanced usage examples.
 from ..quotes import macros, q, u  # noqa: F401
 
 import copy
+import re
 import sys
 from textwrap import dedent
 
 # `expand` and `compile` aren't tested separately, but `run` is built on them, so meh.
 from ..compiler import create_module, temporary_module, run
+from ..core import MacroApplicationError
 from ..utils import gensym, rename
 
 
@@ -288,5 +290,39 @@ def runtests():
                 pass
     test_futureimports_multiphase_withdocstring()
 
+    # The macro use site report shows the invocation as written, also when the
+    # macro expands its inner macro invocations before it raises.
+    def test_macro_use_site_report():
+        try:
+            modname = gensym("usesitemacros")
+            mymacros = create_module(modname)
+            run(dedent("""
+            from mcpyrate.quotes import macros, q
+            def inner(tree, **kw):
+                return q[1 + 2]
+            def outer(tree, *, expander, **kw):
+                expander.visit(tree)
+                raise ValueError("outer failed")
+            """), mymacros)
+
+            sources = ["x = outer[inner[foo] * 10]",
+                       "with outer:\n    x = inner[foo] * 10",
+                       "@outer\ndef f():\n    return inner[foo] * 10"]
+            for source in sources:
+                try:
+                    run(f"from {modname} import macros, inner, outer\n{source}")
+                except MacroApplicationError as err:
+                    msg = re.sub(r"\x1b\[[0-9;]*m", "", str(err))  # strip ANSI color codes
+                    assert "inner[foo] * 10" in msg
+                    assert "1 + 2" not in msg
+                else:
+                    assert False
+        finally:
+            try:
+                del sys.modules[mymacros.__name__]
+            except (NameError, KeyError):
+                pass
+    test_macro_use_site_report()
+
 if __name__ == '__main__':
     runtests()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Test the macro-dependency mtime computation of the importer, and its cache files."""
+
+import importlib
+import importlib.util
+import os
+import pickle
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from ..importer import _macroimport_cache_magic, path_stats
+
+SECOND = 10**9  # in nanoseconds
+T0 = 1000000000 * SECOND  # a fixed point in the past, for setting mtimes
+
+
+def cache_path(path):
+    """Return the path of the macro-import statement cache file for source file `path`."""
+    pyc_path = importlib.util.cache_from_source(path)
+    return pyc_path[:-len(".pyc")] + ".mcpyrate.pickle"
+
+def write(path, text, mtime_ns):
+    """Write a source file, with the given mtime, and make a place for its cache files."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.makedirs(os.path.dirname(cache_path(path)), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def set_old_dir_mtimes(root):
+    """Set the mtimes of `root` and all directories inside it to `T0`.
+
+    This way, any later change in the directories is guaranteed to change their mtimes.
+    """
+    for path, dirs, files in os.walk(root):
+        os.utime(path, ns=(T0, T0))
+
+def mtime_of(path):
+    """Return the macro-enabled mtime of source file `path`, as integer seconds from `T0`."""
+    return round(path_stats(path)["mtime"] - T0 // SECOND)
+
+@contextmanager
+def sandbox(*syspath_entries):
+    """Temporarily put directories on `sys.path`, and make sure cache files get written.
+
+    Finding a module in a package imports the package, so this also unloads
+    the test modules (named `mcpyrate_test_*`) loaded in the meantime.
+    """
+    old_syspath = sys.path[:]
+    old_dont_write_bytecode = sys.dont_write_bytecode
+    sys.path[:0] = syspath_entries
+    sys.dont_write_bytecode = False
+    importlib.invalidate_caches()
+    try:
+        yield
+    finally:
+        sys.path[:] = old_syspath
+        sys.dont_write_bytecode = old_dont_write_bytecode
+        for entry in syspath_entries:
+            sys.path_importer_cache.pop(entry, None)
+        for name in [name for name in sys.modules if name.startswith("mcpyrate_test_")]:
+            del sys.modules[name]
+        importlib.invalidate_caches()
+
+
+def runtests():
+    # When a macro-dependency changes, directly or indirectly, so does the mtime
+    # of the module that uses the macros, also when the cache files exist.
+    def test_changed_dependencies():
+        with tempfile.TemporaryDirectory() as root:
+            user = os.path.join(root, "mcpyrate_test_user1.py")
+            mac1 = os.path.join(root, "mcpyrate_test_mac1.py")
+            mac2 = os.path.join(root, "mcpyrate_test_mac2.py")
+            write(user, "from mcpyrate_test_mac1 import macros, m\n", T0 + 1 * SECOND)
+            write(mac1, "from mcpyrate_test_mac2 import macros, n\n", T0 + 2 * SECOND)
+            write(mac2, "", T0 + 3 * SECOND)
+            set_old_dir_mtimes(root)
+            with sandbox(root):
+                assert mtime_of(user) == 3
+                with open(cache_path(user), "rb") as f:
+                    assert f.read(len(_macroimport_cache_magic)) == _macroimport_cache_magic
+                    assert "resolved" in pickle.load(f)
+                assert mtime_of(user) == 3  # now using the saved result
+
+                os.utime(mac1, ns=(T0 + 5 * SECOND, T0 + 5 * SECOND))
+                assert mtime_of(user) == 5
+
+                os.utime(mac2, ns=(T0 + 7 * SECOND, T0 + 7 * SECOND))
+                assert mtime_of(user) == 7
+    test_changed_dependencies()
+
+    # A new module earlier on `sys.path` shadows the old macro-dependency.
+    def test_shadowing_via_syspath():
+        with tempfile.TemporaryDirectory() as root:
+            early = os.path.join(root, "early")
+            late = os.path.join(root, "late")
+            user = os.path.join(late, "mcpyrate_test_user2.py")
+            mac = os.path.join(late, "mcpyrate_test_shadowmac.py")
+            write(user, "from mcpyrate_test_shadowmac import macros, m\n", T0 + 1 * SECOND)
+            write(mac, "", T0 + 2 * SECOND)
+            os.makedirs(early)
+            set_old_dir_mtimes(root)
+            with sandbox(early, late):
+                assert mtime_of(user) == 2
+                assert mtime_of(user) == 2
+
+                write(os.path.join(early, "mcpyrate_test_shadowmac.py"), "", T0 + 9 * SECOND)
+                importlib.invalidate_caches()
+                assert mtime_of(user) == 9
+    test_shadowing_via_syspath()
+
+    # A new package shadows a module of the same name inside the same package.
+    def test_shadowing_inside_package():
+        with tempfile.TemporaryDirectory() as root:
+            pkg = os.path.join(root, "mcpyrate_test_pkg")
+            user = os.path.join(root, "mcpyrate_test_user3.py")
+            write(user, "from mcpyrate_test_pkg.mac import macros, m\n", T0 + 1 * SECOND)
+            write(os.path.join(pkg, "__init__.py"), "", T0)
+            write(os.path.join(pkg, "mac.py"), "", T0 + 2 * SECOND)
+            set_old_dir_mtimes(root)
+            with sandbox(root):
+                assert mtime_of(user) == 2
+                assert mtime_of(user) == 2
+
+                write(os.path.join(pkg, "mac", "__init__.py"), "", T0 + 9 * SECOND)
+                importlib.invalidate_caches()
+                assert mtime_of(user) == 9
+    test_shadowing_inside_package()
+
+    # Changes that don't affect which files the module lookups find, such as a new
+    # unrelated file, or another directory on `sys.path` (e.g. a different entry
+    # point), don't invalidate the saved result, so the cache file is not rewritten.
+    def test_unrelated_changes():
+        with tempfile.TemporaryDirectory() as root:
+            other = os.path.join(root, "other")
+            app = os.path.join(root, "app")
+            pkg = os.path.join(app, "mcpyrate_test_pkg5")
+            user = os.path.join(app, "mcpyrate_test_user5.py")
+            write(user, "from mcpyrate_test_pkg5.mac import macros, m\n", T0 + 1 * SECOND)
+            write(os.path.join(pkg, "__init__.py"), "", T0)
+            write(os.path.join(pkg, "mac.py"), "", T0 + 2 * SECOND)
+            os.makedirs(other)
+            set_old_dir_mtimes(root)
+            with sandbox(app):
+                assert mtime_of(user) == 2
+                os.utime(cache_path(user), ns=(T0, T0))
+
+                write(os.path.join(app, "mcpyrate_test_unrelated.py"), "", T0 + 9 * SECOND)
+                write(os.path.join(pkg, "unrelated.py"), "", T0 + 9 * SECOND)
+                sys.path.insert(0, other)
+                importlib.invalidate_caches()
+                assert mtime_of(user) == 2
+                assert os.stat(cache_path(user)).st_mtime_ns == T0
+    test_unrelated_changes()
+
+    # A cache file in the old, headerless format is ignored, and replaced.
+    def test_old_cache_format():
+        with tempfile.TemporaryDirectory() as root:
+            user = os.path.join(root, "mcpyrate_test_user4.py")
+            mac = os.path.join(root, "mcpyrate_test_mac4.py")
+            write(user, "from mcpyrate_test_mac4 import macros, m\n", T0 + 1 * SECOND)
+            write(mac, "", T0 + 5 * SECOND)
+            # This claims there are no macro-imports, so using it would give the wrong mtime.
+            old_data = {"st_mtime_ns": T0 + 1 * SECOND,
+                        "macroimports": [],
+                        "dialectimports": [],
+                        "has_relative_macroimports": False}
+            with open(cache_path(user), "wb") as f:
+                pickle.dump(old_data, f)
+            set_old_dir_mtimes(root)
+            with sandbox(root):
+                assert mtime_of(user) == 5
+                with open(cache_path(user), "rb") as f:
+                    assert f.read(len(_macroimport_cache_magic)) == _macroimport_cache_magic
+    test_old_cache_format()
+
+    # A macro-import cycle is reported as an `ImportError` when the modules are
+    # imported, instead of crashing `path_stats` with infinite recursion.
+    def test_macroimport_cycle():
+        with tempfile.TemporaryDirectory() as root:
+            cyc1 = os.path.join(root, "mcpyrate_test_cyc1.py")
+            cyc2 = os.path.join(root, "mcpyrate_test_cyc2.py")
+            write(cyc1, "from mcpyrate_test_cyc2 import macros, n\n", T0 + 1 * SECOND)
+            write(cyc2, "from mcpyrate_test_cyc1 import macros, m\n", T0 + 2 * SECOND)
+            set_old_dir_mtimes(root)
+            with sandbox(root):
+                assert mtime_of(cyc1) == 2
+                assert mtime_of(cyc2) == 2
+                # The result for a cycle member depends on how the cycle was entered,
+                # so it must not be saved.
+                for path in (cyc1, cyc2):
+                    with open(cache_path(path), "rb") as f:
+                        assert f.read(len(_macroimport_cache_magic)) == _macroimport_cache_magic
+                        assert "resolved" not in pickle.load(f)
+                try:
+                    importlib.import_module("mcpyrate_test_cyc1")
+                except ImportError:
+                    pass
+                else:
+                    assert False, "importing a macro-import cycle should fail"
+    test_macroimport_cycle()
+
+if __name__ == '__main__':
+    runtests()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import ast
+import copy
+import pickle
+
+from ..markers import ASTMarker, delete_markers, get_markers
+
+
+class LegacyMarker(ASTMarker):
+    """A marker with an extra field, declared the way older versions of `mcpyrate` did it."""
+    def __init__(self, body=None, myfield=None):
+        super().__init__(body)
+        self.myfield = myfield
+        self._fields += ["myfield"]
+
+
+class ModernMarker(ASTMarker):
+    _fields = ASTMarker._fields + ("myfield",)
+    def __init__(self, body=None, myfield=None):
+        super().__init__(body)
+        self.myfield = myfield
+
+
+def runtests():
+    def test_fields():
+        for cls in (LegacyMarker, ModernMarker):
+            marker = cls(ast.Constant(value=1), ast.Constant(value=2))
+            assert tuple(marker._fields) == ("body", "myfield")
+            assert [name for name, value in ast.iter_fields(marker)] == ["body", "myfield"]
+        # The instance-level `_fields` of a legacy marker must not leak into the class.
+        assert ASTMarker._fields == ("body",)
+        assert LegacyMarker._fields == ("body",)
+    test_fields()
+
+    def test_copy_and_pickle():
+        for cls in (LegacyMarker, ModernMarker):
+            marker = cls(ast.Constant(value=1), ast.Constant(value=2))
+            for clone in (copy.copy(marker),
+                          copy.deepcopy(marker),
+                          pickle.loads(pickle.dumps(marker))):
+                assert type(clone) is cls
+                assert tuple(clone._fields) == ("body", "myfield")
+                assert clone.body.value == 1
+                assert clone.myfield.value == 2
+    test_copy_and_pickle()
+
+    def test_get_and_delete_markers():
+        for cls in (LegacyMarker, ModernMarker):
+            # A marker hidden in the extra field, inside another marker.
+            inner = cls(ast.Constant(value=3))
+            outer = cls(ast.Constant(value=1), ast.BinOp(left=ast.Constant(value=2),
+                                                         op=ast.Add(),
+                                                         right=inner))
+            tree = ast.Expr(value=outer)
+            assert get_markers(tree, cls) == [outer, inner]
+            tree = delete_markers(tree, cls)
+            assert get_markers(tree, cls) == []
+            assert type(tree.value) is ast.Constant and tree.value.value == 1
+            assert inner.body.value == 3
+    test_get_and_delete_markers()
+
+    # In-place list operations on `_fields` no longer work, since it is now a `tuple`.
+    def test_fields_is_immutable():
+        marker = ASTMarker(ast.Constant(value=1))
+        try:
+            marker._fields.append("myfield")
+        except AttributeError:
+            pass
+        else:
+            assert False, "`ASTMarker._fields` should be a tuple"
+    test_fields_is_immutable()
+
+if __name__ == '__main__':
+    runtests()
@@ -125,6 +125,20 @@ def runtests():
     assert unparse(q[q[u[x]]]) == "q[u[x]]"
     assert unparse(q[q[u[u[x]]]]) == "q[u['hi']]"
 
+    # Interpolating a complex number
+    assert unparse(q[u[1+2j]]) == "(1+2j)"
+    z = 1+2j
+    assert eval(unparse(q[u[z]])) == z
+
+    # Repeated occurrences of the same object don't share parts of the output
+    lst = [1, 2]
+    tree = q[u[[lst, lst]]]
+    assert unparse(tree) == "[[1, 2], [1, 2]]"
+    assert tree.elts[0] is not tree.elts[1]
+    assert tree.elts[0].elts is not tree.elts[1].elts
+    tree.elts[0].elts.append(q[3])
+    assert unparse(tree) == "[[1, 2, 3], [1, 2]]"
+
     # TODO: This is testing, beside what we want, an implementation detail;
     # TODO: is there a better way?
     # TODO: Python 3.8: remove ast.Num
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+import io
+import os
+import sys
+import tempfile
+
+from ..repl.utils import sourcecode
+
+
+def runtests():
+    # The REPL caches source code lookups, but editing and reloading a module
+    # must show the new source.
+    def test_sourcecode_after_reload():
+        def get_sourcecode(obj):
+            stream = io.StringIO()
+            sourcecode(obj, file=stream)
+            return stream.getvalue()
+
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "mcpyrate_test_reloadme.py")
+            with open(path, "w") as f:
+                f.write("x = 'old'\n")
+            os.utime(path, ns=(10**18, 10**18))  # make sure the edit changes the mtime
+            sys.path.insert(0, root)
+            importlib.invalidate_caches()
+            try:
+                module = importlib.import_module("mcpyrate_test_reloadme")
+                assert "x = 'old'" in get_sourcecode(module)
+
+                with open(path, "w") as f:
+                    f.write("x = 'new'\n")
+                module = importlib.reload(module)
+                assert module.x == "new"
+                text = get_sourcecode(module)
+                assert "x = 'new'" in text and "x = 'old'" not in text
+            finally:
+                sys.path.remove(root)
+                sys.modules.pop("mcpyrate_test_reloadme", None)
+                importlib.invalidate_caches()
+    test_sourcecode_after_reload()
+
+if __name__ == '__main__':
+    runtests()
@@ -6,8 +6,9 @@ __all__ = ["gensym", "scrub_uuid", "flatten", "rename", "extract_bindings", "get
            "NestingLevelTracker"]
 
 import ast
-from contextlib import contextmanager
-import uuid
+from collections import ChainMap
+import itertools
+import os
 
 from .astcompat import MatchAs, MatchStar
 from .colorizer import colorize, ColorScheme
@@ -16,11 +17,23 @@ from . import unparser
 from . import walkers
 
 
-_previous_gensyms = set()
+# Each gensym gets a 128-bit suffix, formatted like an uuid without the dashes.
+# Instead of generating a fresh random uuid for each gensym, we draw a random
+# starting point once, and count up from there. This guarantees uniqueness
+# within the process, and makes collisions with gensyms made in other
+# processes (e.g. captured in bytecode caches) as unlikely as with uuid4.
+def _reset_gensym_counter():
+    global _gensym_counter
+    _gensym_counter = itertools.count(int.from_bytes(os.urandom(16), "big"))
+_reset_gensym_counter()
+if hasattr(os, "register_at_fork"):  # a forked child must not repeat the parent's gensyms
+    os.register_at_fork(after_in_child=_reset_gensym_counter)
+
 def gensym(basename=None):
     """Create a name for a new, unused lexical identifier, and return the name as an `str`.
 
-    We include an uuid in the name to avoid the need for any lexical scanning.
+    We include a unique 128-bit suffix in the name to avoid the need for any
+    lexical scanning.
 
     Can also be used for globally unique string keys, in which case `basename`
     does not need to be a valid identifier.
@@ -28,8 +41,8 @@ def gensym(basename=None):
     Examples::
 
         gensym()         # --> 'gensym_e010a36f9cd64ad2b14041751ef40a6e'
-        gensym("kitty")  # --> 'kitty_65cc5638659d46209af11e1133698462'
-        gensym("")       # --> '7cf67f3eb02c4fdaa1a13e7f55bca908' (bare uuid only)
+        gensym("kitty")  # --> 'kitty_e010a36f9cd64ad2b14041751ef40a6f'
+        gensym("")       # --> 'e010a36f9cd64ad2b14041751ef40a70' (bare suffix only)
     """
     if basename and not isinstance(basename, str):
         raise TypeError(f"`basename` must be str, got {type(basename)} with value {repr(basename)}")
@@ -40,15 +53,8 @@ def gensym(basename=None):
         basename = basename + "_"
     # else basename = ""
 
-    def generate():
-        unique = str(uuid.uuid4()).replace("-", "")
-        return f"{basename}{unique}"
-    sym = generate()
-    # The uuid spec does not guarantee no collisions, only a vanishingly small chance.
-    while sym in _previous_gensyms:
-        sym = generate()  # pragma: no cover
-    _previous_gensyms.add(sym)
-    return sym
+    unique = next(_gensym_counter) & 0xffffffffffffffffffffffffffffffff  # wrap around at 128 bits
+    return f"{basename}{unique:032x}"
 
 
 def scrub_uuid(string):
@@ -71,13 +77,15 @@ def flatten(lst, *, recursive=True):
 
     Useful for splicing in transformations of statement suites.
     """
+    # This runs for every statement suite the expander walks, so it's micro-optimized.
     out = []
+    append = out.append
+    extend = out.extend
     for elt in lst:
-        if isinstance(elt, list):
-            sublst = flatten(elt) if recursive else elt
-            out.extend(sublst)
+        if type(elt) is list:
+            extend(flatten(elt) if recursive else elt)
         elif elt is not None:
-            out.append(elt)
+            append(elt)
     return out
 
 
@@ -169,6 +177,13 @@ def extract_bindings(bindings, *functions, global_only=False):
         tree = MacroExpander(bindings, expander.filename).visit(tree)
     """
     functions = set(functions)
+    if isinstance(bindings, ChainMap):  # e.g. `expander.bindings`
+        # Iterating over a `ChainMap` is slow, since each item lookup searches
+        # the maps one by one. Flatten it first; the dict updates run at C speed.
+        flat = {}
+        for mapping in reversed(bindings.maps):
+            flat.update(mapping)
+        bindings = flat
     return {name: function for name, function in bindings.items() if function in functions}
 
 
@@ -282,6 +297,27 @@ def format_context(tree, *, n=5):
 
 # --------------------------------------------------------------------------------
 
+class _NestingLevelContext:
+    """Context manager returned by `NestingLevelTracker.set_to`.
+
+    Hand-written instead of `@contextmanager`, because quasiquote macros
+    enter one of these at every invocation.
+    """
+    __slots__ = ("tracker", "value")
+
+    def __init__(self, tracker, value):
+        self.tracker = tracker
+        self.value = value
+
+    def __enter__(self):
+        self.tracker.stack.append(self.value)
+
+    def __exit__(self, exctype, excvalue, traceback):
+        stack = self.tracker.stack
+        stack.pop()
+        assert stack  # postcondition
+
+
 class NestingLevelTracker:
     """Track the nesting level in a set of co-operating, related macros.
 
@@ -317,15 +353,7 @@ class NestingLevelTracker:
             raise TypeError(f"Expected integer `value`, got {type(value)} with value {repr(value)}")
         if value < 0:
             raise ValueError(f"`value` must be >= 0, got {repr(value)}")
-        @contextmanager
-        def _set_to():
-            self.stack.append(value)
-            try:
-                yield
-            finally:
-                self.stack.pop()
-                assert self.stack  # postcondition
-        return _set_to()
+        return _NestingLevelContext(self, value)
 
     def changed_by(self, delta):
         """Context manager. Run a section of code with the level incremented by `delta`.
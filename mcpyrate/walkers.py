@@ -141,7 +141,7 @@ class ASTVisitor(BaseASTWalker, NodeVisitor, metaclass=ABCMeta):
         if newstate:
             self._stack.append(newstate)
         try:
-            if isinstance(tree, list):
+            if type(tree) is list:
                 for elt in tree:
                     self.visit(elt)
                 return
@@ -182,8 +182,8 @@ class ASTTransformer(BaseASTWalker, NodeTransformer, metaclass=ABCMeta):
         if newstate:
             self._stack.append(newstate)
         try:
-            if isinstance(tree, list):
-                new_tree = utils.flatten(self.visit(elt) for elt in tree)
+            if type(tree) is list:
+                new_tree = utils.flatten([self.visit(elt) for elt in tree])
                 if not new_tree:
                     new_tree = []  # preserve the type of `tree`; an empty list shouldn't turn into `None`
                 tree[:] = new_tree